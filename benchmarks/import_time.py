@@ -0,0 +1,56 @@
+"""
+Report import time of `peppertext` using ``python -X importtime``::
+
+   python benchmarks/import_time.py [module ...]
+
+Prints the cumulative time of the given modules (`peppertext` by default)
+and of the modules they import directly, best of five fresh interpreters.
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+
+def importtime(module):
+    """
+    Return cumulative microseconds of `module` and of its direct imports.
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        stderr=subprocess.STDOUT, universal_newlines=True,
+    )
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(cumulative)))
+
+    # Modules are listed after everything they import, one level deeper.
+    for index, (depth, name, cumulative) in enumerate(entries):
+        if name == module:
+            break
+    children = {}
+    for child_depth, child, value in reversed(entries[:index]):
+        if child_depth <= depth:
+            break
+        if child_depth == depth + 1:
+            children[child] = value
+    return cumulative, children
+
+
+def main(modules, repeat=5):
+    for module in modules:
+        total, children = min(
+            (importtime(module) for _ in range(repeat)),
+            key=lambda run: run[0],
+        )
+        print("{}: {:.1f} ms".format(module, total / 1000.0))
+        for name, value in sorted(children.items(), key=lambda item: -item[1]):
+            print("  {:>8.1f} ms  {}".format(value / 1000.0, name))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["peppertext"])
@@ -0,0 +1,163 @@
+"""
+End-to-end load test of resolving and fetching pages from a local mock site.
+
+Starts a `MockSite` and, for every mode, fetches its search pages and
+articles in a fresh interpreter so that peak RSS is measured per mode::
+
+   python benchmarks/loadtest.py --pages 2000 --workers 16
+
+Modes:
+
+sync
+   `resolve()` and `fetch()` one page after another
+threads
+   `fetch()` from a pool of `--workers` threads
+asyncio
+   `resolve()` and `fetch()` from coroutines on an executor of `--workers`
+   threads, as `fetch_async()` runs them
+
+Latencies are timed inside the worker threads in every mode and do not
+include waiting for a free thread.
+
+Each article is requested `--repeat` times in shuffled order, so concurrent
+modes also exercise coalescing of identical fetches.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mocksite  # noqa: E402
+
+
+MODES = ("sync", "threads", "asyncio")
+
+
+def requests_for(root, pages, repeat, seed):
+    articles = [root + mocksite.article_path(number) for number in range(pages)]
+    searches = [
+        (root + "/search", params) for params in mocksite.search_params(pages)
+    ]
+    requests = [(url, {}) for url in articles * repeat] + searches
+    random.Random(seed).shuffle(requests)
+    return requests
+
+
+def timed_fetch(url, params):
+    from peppertext import base
+
+    started = time.time()
+    base.resolve(url, params=params).fetch()
+    return time.time() - started
+
+
+def run(mode, root, pages, repeat, workers, seed):
+    """
+    Fetch every request in `mode` and return a dictionary of measurements.
+    """
+    from peppertext import base
+
+    mocksite.register()
+    requests = requests_for(root, pages, repeat, seed)
+
+    started = time.time()
+    if mode == "sync":
+        latencies = [timed_fetch(url, params) for url, params in requests]
+    elif mode == "threads":
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(workers) as executor:
+            latencies = list(executor.map(lambda request: timed_fetch(*request), requests))
+    elif mode == "asyncio":
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(workers)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            return await asyncio.gather(*[
+                loop.run_in_executor(executor, timed_fetch, url, params)
+                for url, params in requests
+            ])
+
+        latencies = asyncio.run(main())
+        executor.shutdown()
+    else:
+        raise ValueError("Unknown mode: {}".format(mode))
+    elapsed = time.time() - started
+
+    return {
+        "mode": mode,
+        "fetches": len(requests),
+        "seconds": elapsed,
+        "latencies": sorted(latencies),
+        "coalesced": base.flights.stats["coalesced"],
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(results):
+    columns = "{:>8} {:>8} {:>10} {:>9} {:>9} {:>9} {:>10} {:>9}"
+    print(columns.format(
+        "mode", "fetches", "pages/s", "p50 ms", "p90 ms", "p99 ms", "coalesced", "RSS MB"
+    ))
+    for result in results:
+        latencies = result["latencies"]
+        print(columns.format(
+            result["mode"],
+            result["fetches"],
+            "{:.1f}".format(result["fetches"] / result["seconds"]),
+            "{:.1f}".format(percentile(latencies, 0.5) * 1000),
+            "{:.1f}".format(percentile(latencies, 0.9) * 1000),
+            "{:.1f}".format(percentile(latencies, 0.99) * 1000),
+            result["coalesced"],
+            "{:.1f}".format(result["max_rss_kb"] / 1024.0),
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", action="append", choices=MODES)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--links-per-page", type=int, default=20)
+    parser.add_argument("--page-bytes", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.root:
+        # Child process measuring a single mode
+        result = run(args.mode[0], args.root, args.pages, args.repeat, args.workers, args.seed)
+        print(json.dumps(result))
+        return
+
+    site = mocksite.MockSite(args.pages, args.links_per_page, args.page_bytes, args.seed)
+    results = []
+    with site:
+        for mode in args.mode or MODES:
+            output = subprocess.check_output([
+                sys.executable, __file__, "--root", site.root, "--mode", mode,
+                "--pages", str(args.pages), "--repeat", str(args.repeat),
+                "--workers", str(args.workers), "--seed", str(args.seed),
+            ], universal_newlines=True)
+            results.append(json.loads(output))
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Local HTTP site serving a generated link graph, and page classes for it.
+
+The site has `pages` articles at `/{year}/{month}/article-{number}.html`,
+each linking to `links_per_page` other articles picked with a seeded random
+generator and padded to about `page_bytes`, and search pages at
+`/search?page={number}` listing articles ten at a time::
+
+   python benchmarks/mocksite.py --pages 1000 --port 8000
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from peppertext import base
+
+
+SEARCH_PAGE_SIZE = 10
+
+
+def article_path(number):
+    return "/{}/{:02d}/article-{}.html".format(
+        2000 + number % 20, number % 12 + 1, number
+    )
+
+
+def search_params(pages):
+    return [
+        {"page": str(number)}
+        for number in range(-(-pages // SEARCH_PAGE_SIZE))
+    ]
+
+
+class MockSite(object):
+
+    def __init__(self, pages=1000, links_per_page=20, page_bytes=20000,
+                 seed=0, port=0):
+        self.pages = pages
+        self.links_per_page = links_per_page
+        self.page_bytes = page_bytes
+        self.seed = seed
+        self.server = _Server(("127.0.0.1", port), _Handler)
+        self.server.site = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def root(self):
+        return "http://127.0.0.1:{}".format(self.port)
+
+    def article(self, number):
+        rng = random.Random(self.seed * 1000003 + number)
+        links = "".join(
+            '<li><a href="{}">Article {}</a></li>'.format(article_path(target), target)
+            for target in (rng.randrange(self.pages) for _ in range(self.links_per_page))
+        )
+        head = (
+            "<html><head><title>Article {0}</title></head><body>"
+            '<h3 class="title" itemprop="name">Article {0}</h3>'
+            '<div class="post-body">'
+        ).format(number)
+        tail = "</div><ul>{}</ul></body></html>".format(links)
+
+        paragraph = "<p>{}</p>".format(" ".join(
+            "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8))
+            for _ in range(20)
+        ))
+        padding = max(0, self.page_bytes - len(head) - len(tail))
+        body = paragraph * (padding // len(paragraph) + 1)
+        return head + body[:padding] + tail
+
+    def search(self, number):
+        first = number * SEARCH_PAGE_SIZE
+        links = "".join(
+            '<li><a class="result" href="{}">Article {}</a></li>'.format(
+                article_path(target), target
+            )
+            for target in range(first, min(first + SEARCH_PAGE_SIZE, self.pages))
+        )
+        return '<html><body><h3 class="title">Search</h3><ul>{}</ul></body></html>'.format(links)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        site = self.server.site
+        url = urlparse(self.path)
+        try:
+            if url.path == "/search":
+                body = site.search(int(parse_qs(url.query)["page"][0]))
+            else:
+                number = int(url.path.rsplit("-", 1)[1].split(".")[0])
+                if url.path != article_path(number) or not 0 <= number < site.pages:
+                    raise ValueError(url.path)
+                body = site.article(number)
+        except (KeyError, IndexError, ValueError):
+            self.send_error(404)
+            return
+
+        content = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockArticlePage(base.Hypertext):
+    url = base.SimpleURLField(
+        "http://127.0.0.1:{port}/{year}/{month}/{title}.html"
+    )
+
+    title = base.selector.find(".title[itemprop=name]").text()
+    body = base.selector.find(".post-body").text()
+    links = base.selector.find('a').attribute('href', each=True)
+
+
+class MockSearchPage(base.Hypertext):
+    url = base.SimpleURLField("http://127.0.0.1:{port}/search")
+    params = {
+        "page": base.EntityField("page"),
+    }
+
+    results = base.selector.find('a.result').attribute('href', each=True)
+
+
+def register():
+    base.register(MockArticlePage)
+    base.register(MockSearchPage)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--links-per-page", type=int, default=20)
+    parser.add_argument("--page-bytes", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    site = MockSite(args.pages, args.links_per_page, args.page_bytes, args.seed, args.port)
+    print("Serving {} articles at {}".format(site.pages, site.root))
+    try:
+        site.server.serve_forever()
+    except KeyboardInterrupt:
+        site.server.server_close()
@@ -0,0 +1,53 @@
+"""
+Measure cold-start time of defining, registering and resolving page classes.
+
+Each registry size runs in a fresh interpreter so nothing is warmed up::
+
+   python benchmarks/startup.py 10 100 500 1000
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+
+SNIPPET = """
+import time
+started = time.time()
+
+from peppertext import base
+
+for i in range({size}):
+    base.register(type(base.Hypertext)("Page%d" % i, (base.Hypertext,), {{
+        "url": base.SimpleURLField("http://site%d.example.com/{{year}}/{{slug}}.html" % i),
+        "title": base.selector.find(".title").text(),
+        "body": base.selector.find(".body").text(),
+    }}))
+defined = time.time()
+
+base.resolve("http://site0.example.com/2015/manoha.html")
+resolved = time.time()
+
+print("%f %f" % (defined - started, resolved - defined))
+"""
+
+
+def measure(size, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", SNIPPET.format(size=size)]
+        )
+        samples.append([float(value) for value in output.split()])
+    return min(samples, key=sum)
+
+
+def main(sizes):
+    print("{:>8} {:>12} {:>12}".format("classes", "define (ms)", "resolve (ms)"))
+    for size in sizes:
+        define, resolve = measure(size)
+        print("{:>8} {:>12.2f} {:>12.2f}".format(size, define * 1000, resolve * 1000))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 500, 1000])
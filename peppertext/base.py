@@ -25,10 +25,9 @@ Peppertext :: Simple Hypertext Parser
 from copy import copy
 from datetime import datetime
 import re
+import threading
 
-import requests
-from pyquery import PyQuery as pq
-from six import add_metaclass
+from six import add_metaclass, text_type
 
 
 class NotFetchedYetError(Exception):
@@ -47,6 +46,38 @@ class NotResolvedError(Exception):
     pass
 
 
+PyQuery = None
+
+
+def pq(*args, **kwargs):
+    """
+    Build a `PyQuery` object.
+
+    pyquery and lxml are imported on first use so that resolving urls and
+    parsing fields does not load the HTML stack.
+    """
+    global PyQuery
+    if PyQuery is None:
+        from pyquery import PyQuery
+    return PyQuery(*args, **kwargs)
+
+
+def is_element(value):
+    """
+    Tell whether `value` is an lxml element, as found in `find` results.
+    """
+    from lxml import etree
+    return isinstance(value, etree._Element)
+
+
+def outer_html(element):
+    """
+    Serialize an lxml element to HTML, without the text following it.
+    """
+    from lxml import etree
+    return etree.tostring(element, encoding=text_type, method="html", with_tail=False)
+
+
 selector_registry = dict()
 
 
@@ -64,6 +95,7 @@ class Selector(object):
     Document processing pipeline which can be chained.
     """
     name = "selector"
+    args = ((), ())
 
     def __getattribute__(self, key):
         try:
@@ -85,6 +117,7 @@ class Selector(object):
 
     def __call__(self, *args, **kwargs):
         self.set_args(*args, **kwargs)
+        self.args = (args, tuple(sorted(kwargs.items())))
         return self
 
     def set_args(self, *args, **kwargs):
@@ -93,9 +126,38 @@ class Selector(object):
     def filter(self, document):
         return document
 
-    def select(self, document):
+    @property
+    def key(self):
+        """
+        Names and arguments of every step in the chain.
+        Selectors with equal keys select the same value from a document.
+        """
+        previous = self.previous_selector.key if self.previous_selector else ()
+        return previous + ((self.name, self.args),)
+
+    def select(self, document, memo=None):
+        """
+        memo:
+           dictionary of values already selected from `document` by key.
+           Steps found in it are not run again, and new ones are added.
+           Values returned from it are shared and must not be modified.
+        """
+        if memo is None:
+            return self._select(document, memo)
+
+        key = self.key
+        try:
+            if key in memo:
+                return memo[key]
+        except TypeError:  # unhashable arguments
+            return self._select(document, memo)
+
+        value = memo[key] = self._select(document, memo)
+        return value
+
+    def _select(self, document, memo):
         if self.previous_selector:
-            document = self.previous_selector.select(document)
+            document = self.previous_selector.select(document, memo)
 
         return self.filter(document)
 
@@ -249,19 +311,56 @@ class DateFormatField(Field):
 
 class SimpleURLField(Field):
     """
+    Parse url with a pattern having `{variable}` placeholders.
+
+    Regular expressions for the pattern are compiled when the field is first
+    matched, so defining many page classes stays cheap until they are resolved.
     """
     def __init__(self, pattern):
         self.pattern = pattern
+        self._variables = re.findall("{(\w+)}", pattern)
+        # Leading part of the pattern without placeholders or regex syntax,
+        # leaving out a character made optional by a following `?` or `*`.
+        # Strings not starting with it can be rejected without compiling.
+        # Patterns with a top level alternation have no common prefix.
+        self._prefix = re.match(
+            r"(?:[^{}.^$*+?()[\]\\|](?![?*]))*", pattern
+        ).group()
+        if "|" in re.sub(r"\\.", "", pattern):
+            self._prefix = ""
+        self._match_regex = None
+        self._parse_regex = None
+
+    @property
+    def match_regex(self):
+        if self._match_regex is None:
+            valid_template = "[^{}]+?/?".format("\\".join(":/?#[]@!$&'()*+,;="))
+            regex_pattern = re.sub("{\w+}", valid_template, self.pattern)
+            regex_pattern += "$"
+            self._match_regex = re.compile(regex_pattern)
+        return self._match_regex
+
+    @property
+    def parse_regex(self):
+        if self._parse_regex is None:
+            valid_template = "(?P<{var}>[^\:\/\?\#\[\]\@\!\$\&\'\(\)\*\+\,\;\=]+)/?"
+            regex_pattern = self.pattern
+
+            for item in self._variables:
+                regex_pattern = re.sub(
+                    "{\w+}", valid_template.format(var=item), regex_pattern, 1
+                )
+            self._parse_regex = re.compile(regex_pattern)
+        return self._parse_regex
 
     def match(self, string):
-        valid_template = "[^{}]+?/?".format("\\".join(":/?#[]@!$&'()*+,;="))
-        regex_pattern = re.sub("{\w+}", valid_template, self.pattern)
-        regex_pattern += "$"
-        return re.match(regex_pattern, string)
+        if not string.startswith(self._prefix):
+            return None
+        return self.match_regex.match(string)
 
     @property
     def variables(self):
-        return re.findall("{(\w+)}", self.pattern)
+        return list(self._variables)
 
     def expand(self, **kwargs):
         return self.pattern.format(**kwargs)
@@ -270,15 +369,21 @@ class SimpleURLField(Field):
         if not self.match(string):
             raise FieldError("Cannot parse invalid string: {}".format(string))
 
-        valid_template = "(?P<{var}>[^\:\/\?\#\[\]\@\!\$\&\'\(\)\*\+\,\;\=]+)/?"
-        regex_pattern = self.pattern
+        return self.parse_regex.match(string).groupdict()
 
-        for item in self.variables:
-            regex_pattern = re.sub(
-                "{\w+}", valid_template.format(var=item), regex_pattern, 1
-            )
 
-        return re.match(regex_pattern, string).groupdict()
+anchor_selector = selector.find('a')
+
+
+def copy_properties(properties):
+    """
+    Copy properties, and the lists in them, so that values selected through a
+    shared memo can be modified by each page.
+    """
+    return {
+        name: list(value) if type(value) is list else value
+        for name, value in properties.items()
+    }
 
 
 class HypertextBase(type):
@@ -330,23 +435,83 @@ class Hypertext(object):
         return {"url": url, "method": method, "params": params}
 
     def fetch(self):
+        """
+        Download and parse the page.
+
+        Concurrent fetches of the same request, from threads or from
+        `fetch_async`, wait on a single download and share its document.
+        """
         # Expading profile to params
-        self.response = requests.request(**self.expand())
-        self.response.raise_for_status()
+        request = self.expand()
+        key = flight_key(request)
+        try:
+            hash(key)
+        except TypeError:  # params which cannot be coalesced
+            self._fetch(request)
+            return
+
+        leader = flights.do(key, lambda: self._fetch(request))
+        if leader is self:
+            return
+
+        self.response = leader.response
+        self.bodytext = leader.bodytext
+        self.document = leader.document
+        self._links = list(leader._links)
+        self.memo = leader.memo
+        if leader.__class__ is self.__class__:
+            self._properties = copy_properties(leader._properties)
+        else:
+            self._properties = self.select_properties()
+
+    def fetch_async(self, loop=None, executor=None):
+        """
+        Fetch the page in `executor` and return an asyncio future of it.
+        """
+        import asyncio
+
+        loop = loop or asyncio.get_event_loop()
+        return loop.run_in_executor(executor, self.fetch)
+
+    def _fetch(self, request):
+        import requests
+
+        self.load(requests.request(**request))
+        return self
+
+    def load(self, response):
+        """
+        Parse links and properties from a response to the page's request.
+        """
+        response.raise_for_status()
+        self.response = response
 
         self.bodytext = self.response.text
-        self.document = pq(self.bodytext)
+        self.parse_document(pq(self.bodytext))
+
+    def parse_document(self, document, memo=None):
+        """
+        Parse links and properties from an already parsed document.
+
+        Pages sharing a `memo` for the same document run each distinct
+        selector step once and share the selected values.
+        """
+        self.document = document
+        self.memo = {} if memo is None else memo
 
         # Property Parsing
-        link_elements = self.document('a')
+        link_elements = anchor_selector.select(self.document, self.memo)
         self._links = [
             {"url": e.attrib.get("href", None), "method": "GET"}
             for e in link_elements
         ]
-        self._properties = {
-            name: selector.select(self.document)
+        self._properties = self.select_properties()
+
+    def select_properties(self):
+        return copy_properties({
+            name: selector.select(self.document, self.memo)
             for name, selector in self.__class__.selectors.items()
-        }
+        })
 
     def get_links(self, fetch=False):
         if self._links is not None:
@@ -402,6 +567,75 @@ class Hypertext(object):
         return profile_vars
 
 
+class SingleFlight(object):
+    """
+    Deduplicates concurrent calls sharing the same key.
+
+    The first caller of `do` for a key runs the function and every caller
+    arriving while it is still in flight waits for it and gets the same result
+    (or exception) back instead of running the function again.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = {"calls": 0, "executed": 0, "coalesced": 0}
+
+    def do(self, key, function):
+        with self.lock:
+            self.stats["calls"] += 1
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.stats["executed"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+flights = SingleFlight()
+
+
+def flight_key(request):
+    """
+    Make a key from a dictionary returned by `Hypertext.expand`.
+
+    List values of params, sent as repeated query arguments, become tuples.
+    Other unhashable values leave the key unhashable.
+    """
+    return (
+        request["url"],
+        request["method"],
+        tuple(sorted(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in request["params"].items()
+        )),
+    )
+
+
 registry = []
 
 
@@ -0,0 +1,238 @@
+"""
+Streaming export of fetched pages.
+
+Sinks take fetched pages one at a time, buffer their records in batches and
+write them to a series of files, starting a new file when the current one
+grows past `max_bytes`. A crawl can hand every page to a sink right after
+`fetch()` and drop it, so memory stays bounded by the batch size.
+
+.. code-block:: python
+
+   with JSONLinesSink("out/pages", compress=True) as sink:
+       for page in pages:
+           page.fetch()
+           sink.write(page)
+
+   >>> sink.paths
+   ['out/pages-00000.jsonl.gz', 'out/pages-00001.jsonl.gz']
+"""
+import csv
+from datetime import date
+import gzip
+import io
+import json
+import os
+
+import six
+
+from .base import is_element, outer_html
+
+
+COLUMNS = ("class", "profile_vars", "properties", "links")
+
+
+def record(page):
+    """
+    Make an exportable record from a fetched page.
+
+    Elements in the properties, as selected by `find` or `at`, are written
+    as their HTML.
+    """
+    return {
+        "class": page.__class__.__name__,
+        "profile_vars": page.profile_vars,
+        "properties": page.get_properties(),
+        "links": page.get_links(),
+    }
+
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if is_element(value):
+        return outer_html(value)
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def dumps(value):
+    return json.dumps(value, default=_default, ensure_ascii=False, sort_keys=True)
+
+
+class Sink(object):
+    """
+    Batched writer rotating its output files by size.
+
+    Files are named `{prefix}-{index:05d}{extension}`. Subclasses implement
+    `open_file`, `write_batch` and `close_file`.
+    """
+    extension = ""
+
+    def __init__(self, prefix, batch_size=1000, max_bytes=256 * 1024 * 1024):
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.batch = []
+        self.paths = []
+        self.file = None
+
+    def write(self, page):
+        self.write_record(record(page))
+
+    def write_record(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        if self.file is None:
+            path = "{}-{:05d}{}".format(self.prefix, len(self.paths), self.extension)
+            self.paths.append(path)
+            self.file = self.open_file(path)
+
+        self.write_batch(self.batch)
+        self.batch = []
+
+        if self.size() >= self.max_bytes:
+            self.close_file()
+            self.file = None
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.close_file()
+            self.file = None
+
+    def size(self):
+        return os.path.getsize(self.paths[-1])
+
+    def open_file(self, path):
+        raise NotImplementedError
+
+    def write_batch(self, batch):
+        raise NotImplementedError
+
+    def close_file(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _StreamSink(Sink):
+    """
+    Sink writing text to a file, gzip-compressed if `compress` is set.
+    """
+    def __init__(self, prefix, compress=False, **kwargs):
+        super(_StreamSink, self).__init__(prefix, **kwargs)
+        self.compress = compress
+        if compress:
+            self.extension += ".gz"
+
+    def open_file(self, path):
+        self.raw = io.open(path, "wb")
+        binary = self.raw
+        if self.compress:
+            binary = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        return io.TextIOWrapper(binary, encoding="utf-8", newline="")
+
+    def size(self):
+        self.file.flush()
+        return self.raw.tell()
+
+    def close_file(self):
+        self.file.close()
+        self.raw.close()
+
+
+class JSONLinesSink(_StreamSink):
+    """
+    Write one JSON object per line.
+    """
+    extension = ".jsonl"
+
+    def write_batch(self, batch):
+        self.file.write(u"".join(dumps(item) + u"\n" for item in batch))
+
+
+class CSVSink(_StreamSink):
+    """
+    Write records as CSV rows of `COLUMNS`, nested values as JSON.
+    """
+    extension = ".csv"
+
+    def open_file(self, path):
+        stream = super(CSVSink, self).open_file(path)
+        if six.PY2:
+            # csv writes byte strings on Python 2
+            stream = stream.detach()
+        self.writer = csv.writer(stream)
+        self.writer.writerow(_csv_row(COLUMNS))
+        return stream
+
+    def write_batch(self, batch):
+        self.writer.writerows(_csv_row(_row(item)) for item in batch)
+
+
+class ParquetSink(Sink):
+    """
+    Write records as Parquet columns of `COLUMNS`, nested values as JSON.
+
+    Each batch is written as a row group. Requires pyarrow.
+    """
+    extension = ".parquet"
+
+    def __init__(self, prefix, compression="snappy", **kwargs):
+        super(ParquetSink, self).__init__(prefix, **kwargs)
+        self.compression = compression
+
+    def open_file(self, path):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.schema = pyarrow.schema([(name, pyarrow.string()) for name in COLUMNS])
+        return pyarrow.parquet.ParquetWriter(
+            path, self.schema, compression=self.compression
+        )
+
+    def write_batch(self, batch):
+        import pyarrow
+
+        rows = [_row(item) for item in batch]
+        self.file.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, pyarrow.string()) for column in zip(*rows)],
+            schema=self.schema,
+        ))
+
+    def close_file(self):
+        self.file.close()
+
+
+def _row(item):
+    return [item["class"]] + [dumps(item[name]) for name in COLUMNS[1:]]
+
+
+def _csv_row(row):
+    if six.PY2:
+        return [
+            value if isinstance(value, bytes) else value.encode("utf-8")
+            for value in row
+        ]
+    return row
+
+
+def columnar_sink(prefix, **kwargs):
+    """
+    Make a `ParquetSink` if pyarrow is installed, or a `CSVSink` otherwise.
+    """
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        kwargs.pop("compression", None)
+        return CSVSink(prefix, **kwargs)
+    kwargs.pop("compress", None)
+    return ParquetSink(prefix, **kwargs)
@@ -0,0 +1,202 @@
+"""
+Incremental recrawling of pages.
+
+A `RecrawlStore` remembers, per page class and profile variables, the
+validators and hashes of the last response together with the parsed links and
+properties. `recrawl` sends a conditional request with those validators and
+only parses the body when the server reports it modified and its hash
+differs from the stored one.
+
+.. code-block:: python
+
+   store = RecrawlStore("recrawl.db")
+   change = recrawl(resolve("https://googleblog.blogspot.kr/"), store)
+
+   >>> change.status
+   'changed'
+   >>> change.properties
+   {'title': ('Old title', 'New title')}
+"""
+import hashlib
+import json
+import shelve
+
+import six
+
+from .base import is_element, outer_html
+
+
+NEW = "new"
+NOT_MODIFIED = "not_modified"
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+
+
+class RecrawlStore(object):
+    """
+    Entries of recrawled pages, kept in a dict or in a shelf file at `path`.
+
+    Elements in stored properties are kept as their HTML. Other property
+    values must be picklable when `path` is given.
+    """
+    def __init__(self, path=None):
+        self.entries = shelve.open(path) if path else {}
+
+    def key(self, page):
+        cls = page.__class__
+        return "{}.{}:{!r}".format(
+            cls.__module__, cls.__name__, sorted(page.profile_vars.items())
+        )
+
+    def get(self, page):
+        return self.entries.get(self.key(page))
+
+    def put(self, page, entry):
+        self.entries[self.key(page)] = entry
+
+    def close(self):
+        if hasattr(self.entries, "close"):
+            self.entries.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Change(object):
+    """
+    Outcome of a recrawl.
+
+    status:
+       `NEW`, `NOT_MODIFIED`, `UNCHANGED` or `CHANGED`
+
+    properties:
+       `{name: (old value, new value)}` of properties that differ from the
+       previous crawl. Properties which did not exist before have `None` as
+       their old value.
+    """
+    def __init__(self, status, properties=None):
+        self.status = status
+        self.properties = properties or {}
+
+    def __repr__(self):
+        return "<Change {} {}>".format(self.status, sorted(self.properties))
+
+
+def fingerprint(value):
+    """
+    Hash a response body or a selected value.
+    """
+    if not isinstance(value, six.binary_type):
+        value = json.dumps(value, default=_text, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(value).hexdigest()
+
+
+def _text(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if is_element(value):
+        return outer_html(value)
+    if callable(value) and hasattr(value, "__name__"):
+        # Functions passed to `cast`, without their address
+        return "{}.{}".format(
+            value.__module__, getattr(value, "__qualname__", value.__name__)
+        )
+    return six.text_type(value)
+
+
+def selectors_fingerprint(cls):
+    """
+    Hash the names and steps of a page class's selectors.
+    """
+    return fingerprint(sorted(
+        (name, selector.key) for name, selector in cls.selectors.items()
+    ))
+
+
+def recrawl(page, store, session=None):
+    """
+    Fetch `page` again, reusing what `store` knows about its last crawl.
+
+    `session` is anything with a `requests.request` compatible `request`
+    method, `requests` itself by default. Returns a `Change`.
+
+    Stored entries are ignored, apart from reporting changes, when the
+    selectors of the page class differ from the last crawl.
+
+    Pages restored from the store are not parsed again: their `document` is
+    `None`, and so is their `bodytext` when the server answered 304. Their
+    properties have the HTML of elements in place of the elements.
+    """
+    if session is None:
+        import requests as session
+
+    selectors = selectors_fingerprint(page.__class__)
+    entry = store.get(page)
+    reusable = entry is not None and entry.get("selectors") == selectors
+    headers = {}
+    if reusable:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = session.request(headers=headers, **page.expand())
+
+    if reusable and response.status_code == 304:
+        _restore(page, response, None, entry)
+        return Change(NOT_MODIFIED)
+
+    response.raise_for_status()
+    body_hash = fingerprint(response.content)
+
+    if reusable and entry["body_hash"] == body_hash:
+        _restore(page, response, response.text, entry)
+        change = Change(UNCHANGED)
+    else:
+        page.load(response)
+        change = Change(NEW if entry is None else CHANGED)
+
+    property_hashes = {
+        name: fingerprint(value) for name, value in page._properties.items()
+    }
+    if entry is not None:
+        old_hashes = entry["property_hashes"]
+        old_properties = entry["properties"]
+        for name in set(property_hashes) | set(old_hashes):
+            if property_hashes.get(name) != old_hashes.get(name):
+                change.properties[name] = (
+                    old_properties.get(name), page._properties.get(name)
+                )
+
+    store.put(page, {
+        "selectors": selectors,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "body_hash": body_hash,
+        "property_hashes": property_hashes,
+        "properties": {
+            name: _storable(value) for name, value in page._properties.items()
+        },
+        "links": page._links,
+    })
+    return change
+
+
+def _storable(value):
+    # PyQuery objects are lists of elements
+    if isinstance(value, list):
+        return [_storable(item) for item in value]
+    if is_element(value):
+        return outer_html(value)
+    return value
+
+
+def _restore(page, response, bodytext, entry):
+    page.response = response
+    page.bodytext = bodytext
+    page.document = None
+    page._links = list(entry["links"])
+    page._properties = dict(entry["properties"])
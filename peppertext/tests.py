@@ -1,12 +1,23 @@
 # -*-coding:utf-8-*-
 from __future__ import unicode_literals
 
+import csv
 from datetime import datetime
-from unittest import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipIf
 
 from pyquery import PyQuery as pq
 
-from peppertext import base
+from peppertext import base, export, recrawl
 
 
 class SelectorTestCase(TestCase):
@@ -68,6 +79,64 @@ class SelectorTestCase(TestCase):
         ])
 
 
+    def test_selector_key(self):
+        self.assertEqual(
+            base.selector.find('a').attribute('href', each=True).key,
+            base.selector.find('a').attribute('href', each=True).key,
+        )
+        self.assertNotEqual(
+            base.selector.find('a').attribute('href', each=True).key,
+            base.selector.find('a').attribute('href').key,
+        )
+
+    def test_select_with_memo_runs_each_step_once(self):
+        document = pq('<div><a href="http://example.com">Link1</a></div>')
+        memo = {}
+
+        hrefs = base.selector.find('a').attribute('href', each=True)
+        texts = base.selector.find('a').text(each=True)
+        self.assertEqual(hrefs.select(document, memo), ["http://example.com"])
+        self.assertEqual(texts.select(document, memo), ["Link1"])
+        self.assertEqual(len(memo), 4)  # root, find('a'), attribute and text
+
+        selected = base.selector.find('a').attribute('href', each=True).select(document, memo)
+        self.assertIs(selected, hrefs.select(document, memo))
+
+    def test_select_with_memo_and_unhashable_arguments(self):
+        class Length(object):
+            __hash__ = None
+
+            def __call__(self, value):
+                return len(value)
+
+        document = pq('<a href="http://example.com">')
+        memo = {}
+        length = base.selector.find('a').attribute('href').cast(Length())
+        self.assertEqual(length.select(document, memo), 18)
+        self.assertEqual(len(memo), 3)  # cast step is not memoized
+
+    def test_pages_sharing_a_memo(self):
+        document = pq('<div><h1>Manoha</h1><a href="http://example.com">Link1</a></div>')
+        memo = {}
+
+        page = base.Hypertext(url="http://example.com")
+        page.parse_document(document, memo)
+        other = TitlePage(slug="manoha")
+        other.parse_document(document, memo)
+
+        self.assertEqual(page.get_links(), [{"url": "http://example.com", "method": "GET"}])
+        self.assertEqual(other.get_links(), page.get_links())
+        self.assertEqual(other["title"], "Manoha")
+        self.assertIsNot(page["links"], memo[base.Hypertext.selectors["links"].key])
+        page["links"].append("http://example.com/manoha")
+        self.assertEqual(
+            memo[base.Hypertext.selectors["links"].key], ["http://example.com"]
+        )
+        # `links` starts with the step used for `get_links`
+        links_selector = base.Hypertext.selectors["links"]
+        self.assertEqual(links_selector.previous_selector.key, base.anchor_selector.key)
+
+
 class DateFormatFieldTestCase(TestCase):
 
     def test_date_format_field(self):
@@ -152,6 +221,522 @@ class SimpleURLFieldTestCase(TestCase):
         self.assertTrue(field.parse(url), profile_vars)
         self.assertTrue(field.expand(**profile_vars), url)
 
+    def test_regex_is_not_compiled_for_other_prefixes(self):
+        field = base.SimpleURLField("http://example.com/{year}")
+
+        self.assertFalse(field.match("https://googleblog.blogspot.kr/2015"))
+        self.assertIsNone(field._match_regex)
+
+        self.assertTrue(field.match("http://example.com/2015"))
+        self.assertTrue(field.match("http://exampleXcom/2015"))  # "." is a wildcard
+        self.assertIsNotNone(field._match_regex)
+
+    def test_prefix_leaves_out_optional_characters(self):
+        field = base.SimpleURLField("http://localhost/items/?")
+        self.assertEqual(field._prefix, "http://localhost/items")
+        self.assertTrue(field.match("http://localhost/items"))
+        self.assertTrue(field.match("http://localhost/items/"))
+
+        field = base.SimpleURLField("http://localhost/items/*{id}")
+        self.assertEqual(field._prefix, "http://localhost/items")
+        self.assertTrue(field.match("http://localhost/items1"))
+
+        field = base.SimpleURLField("http://a.com/x|http://b.com/{id}")
+        self.assertEqual(field._prefix, "")
+        self.assertTrue(field.match("http://a.com/x"))
+        self.assertTrue(field.match("http://b.com/3"))
+
+        field = base.SimpleURLField("http://a.com/x\\|y")
+        self.assertEqual(field._prefix, "http://a")
+
+
+class LazyImportTestCase(TestCase):
+
+    def test_resolve_does_not_import_http_and_html_stacks(self):
+        output = subprocess.check_output([sys.executable, "-c", (
+            "import sys\n"
+            "from peppertext import base\n"
+            "base.register(base.Hypertext)\n"
+            "base.resolve('http://example.com')\n"
+            "print(sorted(m for m in ('requests', 'pyquery', 'lxml') if m in sys.modules))\n"
+        )], universal_newlines=True)
+        self.assertEqual(output.strip(), "[]")
+
+
+class SingleFlightTestCase(TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        flights = base.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def download():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "document"
+
+        results = []
+
+        def worker():
+            results.append(flights.do("key", download))
+
+        leader = threading.Thread(target=worker)
+        leader.start()
+        started.wait()
+
+        followers = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        while flights.stats["calls"] < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["document"] * 5)
+        self.assertEqual(flights.stats, {"calls": 5, "executed": 1, "coalesced": 4})
+        self.assertEqual(flights.flights, {})
+
+    def test_sequential_calls_are_not_coalesced(self):
+        flights = base.SingleFlight()
+        self.assertEqual(flights.do("key", lambda: 1), 1)
+        self.assertEqual(flights.do("key", lambda: 2), 2)
+        self.assertEqual(flights.stats["coalesced"], 0)
+
+    def test_error_is_shared_and_flight_is_cleared(self):
+        flights = base.SingleFlight()
+
+        def fail():
+            raise ValueError("manoha")
+
+        with self.assertRaises(ValueError):
+            flights.do("key", fail)
+        self.assertEqual(flights.flights, {})
+
+    def test_error_is_shared_when_leader_is_interrupted(self):
+        flights = base.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def interrupted():
+            started.set()
+            release.wait()
+            raise KeyboardInterrupt()
+
+        def leader():
+            try:
+                flights.do("key", interrupted)
+            except KeyboardInterrupt as e:
+                errors.append(e)
+
+        def follower():
+            try:
+                flights.do("key", lambda: "document")
+            except KeyboardInterrupt as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=leader)]
+        threads[0].start()
+        started.wait()
+        threads.append(threading.Thread(target=follower))
+        threads[1].start()
+        while flights.stats["calls"] < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+
+    def test_flight_key_ignores_params_order(self):
+        self.assertEqual(
+            base.flight_key({"url": "u", "method": "GET", "params": {"a": "1", "b": "2"}}),
+            base.flight_key({"url": "u", "method": "GET", "params": {"b": "2", "a": "1"}}),
+        )
+
+    def test_flight_key_with_list_params(self):
+        key = base.flight_key({"url": "u", "method": "GET", "params": {"tags": ["a", "b"]}})
+        self.assertEqual(key, ("u", "GET", (("tags", ("a", "b")),)))
+        hash(key)
+
+
+class CoalescedFetchTestCase(TestCase):
+
+    def setUp(self):
+        import requests
+
+        self.addCleanup(setattr, base, "flights", base.flights)
+        self.addCleanup(setattr, requests, "request", requests.request)
+        self.flights = base.flights = base.SingleFlight()
+        requests.request = self.request
+
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.downloads = []
+
+    def request(self, **kwargs):
+        self.downloads.append(kwargs)
+        self.started.set()
+        self.release.wait()
+        return FakeResponse(200, '<h1>Manoha</h1><a href="http://example.com/dahokan">Dahokan</a>')
+
+    def release_after(self, calls):
+        def release():
+            while self.flights.stats["calls"] < calls:
+                time.sleep(0.001)
+            self.release.set()
+
+        return threading.Thread(target=release)
+
+    def assert_coalesced(self, leader, followers):
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual(self.flights.stats, {
+            "calls": 1 + len(followers), "executed": 1, "coalesced": len(followers),
+        })
+        self.assertEqual(leader.get_properties(), {"links": ["http://example.com/dahokan"]})
+        for page in followers:
+            self.assertIs(page.response, leader.response)
+            self.assertIs(page.document, leader.document)
+            self.assertEqual(page.get_links(), leader.get_links())
+            self.assertEqual(page["title"], "Manoha")
+            self.assertEqual(set(page.get_properties()), {"title", "body"})
+
+    def test_threads_share_one_download(self):
+        leader = base.Hypertext(url="http://example.com/manoha")
+        followers = [TitlePage(slug="manoha"), TitlePage(slug="manoha")]
+
+        threads = [threading.Thread(target=leader.fetch)]
+        threads[0].start()
+        self.started.wait()
+        threads.extend(threading.Thread(target=page.fetch) for page in followers)
+        threads.append(self.release_after(3))
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assert_coalesced(leader, followers)
+
+    def test_fetch_with_list_and_unhashable_params(self):
+        class TaggedPage(base.Hypertext):
+            url = base.SimpleURLField("http://example.com/{slug}")
+            params = {"tags": ["a", "b"]}
+
+        class FilteredPage(base.Hypertext):
+            url = base.SimpleURLField("http://example.com/{slug}")
+            params = {"filter": {"year": "2015"}}
+
+        self.release.set()
+        for page in [TaggedPage(slug="manoha"), FilteredPage(slug="manoha")]:
+            page.fetch()
+            self.assertEqual(page.get_links(), [
+                {"url": "http://example.com/dahokan", "method": "GET"}
+            ])
+        self.assertEqual(self.downloads[0]["params"], {"tags": ["a", "b"]})
+        self.assertEqual(len(self.downloads), 2)
+        self.assertEqual(self.flights.stats["calls"], 1)  # FilteredPage is not coalesced
+
+    @skipIf(sys.version_info < (3, 4), "asyncio is not available")
+    def test_fetch_async_shares_one_download(self):
+        import asyncio
+
+        leader = base.Hypertext(url="http://example.com/manoha")
+        followers = [TitlePage(slug="manoha"), TitlePage(slug="manoha")]
+
+        thread = threading.Thread(target=leader.fetch)
+        thread.start()
+        self.started.wait()
+        releaser = self.release_after(3)
+        releaser.start()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(asyncio.gather(
+            *[page.fetch_async(loop=loop) for page in followers]
+        ))
+        thread.join()
+        releaser.join()
+
+        self.assert_coalesced(leader, followers)
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.directory, "pages")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_page(self, number):
+        page = base.Hypertext(url="http://example.com/%d" % number)
+        page._properties = {"links": ["http://example.com/%d" % (number + 1)]}
+        page._links = [{"url": "http://example.com/%d" % (number + 1), "method": "GET"}]
+        return page
+
+    def test_record(self):
+        page = self.make_page(0)
+        self.assertEqual(export.record(page), {
+            "class": "Hypertext",
+            "profile_vars": {"url": "http://example.com/0"},
+            "properties": {"links": ["http://example.com/1"]},
+            "links": [{"url": "http://example.com/1", "method": "GET"}],
+        })
+
+    def test_json_lines_sink_batches_and_rotates(self):
+        sink = export.JSONLinesSink(self.prefix, batch_size=10, max_bytes=2500)
+        with sink:
+            for number in range(25):
+                sink.write(self.make_page(number))
+                if number == 8:
+                    self.assertEqual(sink.paths, [])
+
+        self.assertEqual(sink.paths, [
+            self.prefix + "-00000.jsonl", self.prefix + "-00001.jsonl",
+        ])
+        lines = []
+        for path in sink.paths:
+            with io.open(path, encoding="utf-8") as f:
+                lines.extend(f.read().splitlines())
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(json.loads(lines[24])["profile_vars"], {"url": "http://example.com/24"})
+
+    def test_compressed_json_lines_sink(self):
+        with export.JSONLinesSink(self.prefix, compress=True) as sink:
+            sink.write_record({"class": "Page", "profile_vars": {"date": datetime(2015, 12, 31)}})
+
+        self.assertEqual(sink.paths, [self.prefix + "-00000.jsonl.gz"])
+        with gzip.open(sink.paths[0]) as f:
+            self.assertEqual(json.loads(f.read().decode("utf-8")), {
+                "class": "Page", "profile_vars": {"date": "2015-12-31T00:00:00"},
+            })
+
+    def test_csv_sink(self):
+        with export.CSVSink(self.prefix) as sink:
+            sink.write(self.make_page(0))
+
+        with io.open(sink.paths[0], encoding="utf-8", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], list(export.COLUMNS))
+        self.assertEqual(rows[1][0], "Hypertext")
+        self.assertEqual(json.loads(rows[1][2]), {"links": ["http://example.com/1"]})
+
+    def test_export_parsed_page_with_elements(self):
+        page = ListPage(slug="manoha")
+        page.parse_document(pq(
+            '<div><h1>Manoha</h1><ul><li class="x">A</li> <li>B</li></ul></div>'
+        ))
+
+        with export.JSONLinesSink(self.prefix) as sink:
+            sink.write(page)
+        with io.open(sink.paths[0], encoding="utf-8") as f:
+            properties = json.loads(f.read())["properties"]
+        self.assertEqual(properties, {
+            "title": "Manoha",
+            "items": ['<li class="x">A</li>', "<li>B</li>"],
+            "first": ['<li class="x">A</li>'],
+        })
+
+        with export.CSVSink(self.prefix + "-csv") as sink:
+            sink.write(page)
+        with io.open(sink.paths[0], encoding="utf-8", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(json.loads(rows[1][2]), properties)
+
+    def test_columnar_sink_falls_back_to_csv(self):
+        try:
+            import pyarrow.parquet  # noqa: F401
+            expected = export.ParquetSink
+        except ImportError:
+            expected = export.CSVSink
+        self.assertIsInstance(export.columnar_sink(self.prefix), expected)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ValueError(self.status_code)
+
+
+class FakeSession(object):
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, **kwargs):
+        self.requests.append(kwargs)
+        return self.responses.pop(0)
+
+
+class TitlePage(base.Hypertext):
+    url = base.SimpleURLField("http://example.com/{slug}")
+
+    title = base.selector.find('h1').text()
+    body = base.selector.find('p').text()
+
+
+class ListPage(base.Hypertext):
+    url = base.SimpleURLField("http://example.com/list/{slug}")
+
+    title = base.selector.find('h1').text()
+    items = base.selector.find('li')
+    first = base.selector.find('li').at(0)
+
+
+class RecrawlTestCase(TestCase):
+
+    def test_recrawl(self):
+        store = recrawl.RecrawlStore()
+        headers = {"ETag": '"v1"', "Last-Modified": "Thu, 31 Dec 2015 00:00:00 GMT"}
+        session = FakeSession(
+            FakeResponse(200, "<h1>Manoha</h1><p>Body</p>", headers),
+            FakeResponse(304),
+            FakeResponse(200, "<h1>Manoha</h1><p>Body</p>", {"ETag": '"v2"'}),
+            FakeResponse(200, "<h1>Dahokan</h1><p>Body</p>", {"ETag": '"v3"'}),
+        )
+
+        change = recrawl.recrawl(TitlePage(slug="manoha"), store, session)
+        self.assertEqual(change.status, recrawl.NEW)
+        self.assertEqual(session.requests[0]["headers"], {})
+
+        page = TitlePage(slug="manoha")
+        change = recrawl.recrawl(page, store, session)
+        self.assertEqual(change.status, recrawl.NOT_MODIFIED)
+        self.assertEqual(session.requests[1]["headers"], {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Thu, 31 Dec 2015 00:00:00 GMT",
+        })
+        self.assertEqual(page["title"], "Manoha")
+        self.assertIsNone(page.bodytext)
+        self.assertIsNone(page.document)
+
+        page = TitlePage(slug="manoha")
+        change = recrawl.recrawl(page, store, session)
+        self.assertEqual(change.status, recrawl.UNCHANGED)
+        self.assertEqual(change.properties, {})
+        self.assertEqual(page.bodytext, "<h1>Manoha</h1><p>Body</p>")
+        self.assertIsNone(page.document)
+
+        page = TitlePage(slug="manoha")
+        change = recrawl.recrawl(page, store, session)
+        self.assertEqual(session.requests[3]["headers"], {"If-None-Match": '"v2"'})
+        self.assertEqual(change.status, recrawl.CHANGED)
+        self.assertEqual(change.properties, {"title": ("Manoha", "Dahokan")})
+        self.assertEqual(page["title"], "Dahokan")
+
+    def test_changed_selectors_invalidate_the_entry(self):
+        store = recrawl.RecrawlStore()
+        body = '<h1>Manoha</h1><p>Body</p><span class="author">Dahokan</span>'
+        session = FakeSession(
+            FakeResponse(200, body, {"ETag": '"v1"'}),
+            FakeResponse(200, body, {"ETag": '"v1"'}),
+        )
+        recrawl.recrawl(TitlePage(slug="manoha"), store, session)
+
+        # The same class deployed with one more selector
+        DeployedTitlePage = type(TitlePage)(str("TitlePage"), (base.Hypertext,), {
+            "__module__": TitlePage.__module__,
+            "url": TitlePage.url,
+            "title": TitlePage.title,
+            "body": TitlePage.body,
+            "author": base.selector.find('.author').text(),
+        })
+        page = DeployedTitlePage(slug="manoha")
+        self.assertEqual(store.key(page), store.key(TitlePage(slug="manoha")))
+
+        change = recrawl.recrawl(page, store, session)
+        self.assertEqual(session.requests[1]["headers"], {})
+        self.assertEqual(change.status, recrawl.CHANGED)
+        self.assertEqual(change.properties, {"author": (None, "Dahokan")})
+        self.assertEqual(page["author"], "Dahokan")
+
+    def test_selectors_fingerprint_ignores_function_addresses(self):
+        def make_class(function):
+            return type(base.Hypertext)(str("Page"), (base.Hypertext,), {
+                "length": base.selector.text().cast(function),
+            })
+
+        def make_function():
+            def length(value):
+                return len(value)
+            return length
+
+        length, other_length = make_function(), make_function()
+        self.assertIsNot(length, other_length)
+        self.assertEqual(
+            recrawl.selectors_fingerprint(make_class(length)),
+            recrawl.selectors_fingerprint(make_class(other_length)),
+        )
+        self.assertNotEqual(
+            recrawl.selectors_fingerprint(make_class(length)),
+            recrawl.selectors_fingerprint(make_class(len)),
+        )
+
+    def test_store_persists_to_shelf(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "recrawl")
+
+        with recrawl.RecrawlStore(path) as store:
+            session = FakeSession(FakeResponse(200, "<h1>Manoha</h1>", {"ETag": '"v1"'}))
+            recrawl.recrawl(TitlePage(slug="manoha"), store, session)
+
+        with recrawl.RecrawlStore(path) as store:
+            session = FakeSession(FakeResponse(304))
+            page = TitlePage(slug="manoha")
+            self.assertEqual(recrawl.recrawl(page, store, session).status, recrawl.NOT_MODIFIED)
+            self.assertEqual(page["title"], "Manoha")
+
+    def test_element_properties(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "recrawl")
+
+        with recrawl.RecrawlStore(path) as store:
+            session = FakeSession(
+                FakeResponse(200, "<h1>Manoha</h1><ul><li>A</li><li>B</li></ul>"),
+                FakeResponse(200, "<h1>Dahokan</h1><ul><li>A</li><li>B</li></ul>"),
+                FakeResponse(200, "<h1>Dahokan</h1><ul><li>A</li><li>B</li></ul>"),
+            )
+            recrawl.recrawl(ListPage(slug="manoha"), store, session)
+
+            change = recrawl.recrawl(ListPage(slug="manoha"), store, session)
+            self.assertEqual(change.status, recrawl.CHANGED)
+            self.assertEqual(sorted(change.properties), ["title"])
+
+            page = ListPage(slug="manoha")
+            change = recrawl.recrawl(page, store, session)
+            self.assertEqual(change.status, recrawl.UNCHANGED)
+            self.assertEqual(change.properties, {})
+            self.assertEqual(page["items"], ["<li>A</li>", "<li>B</li>"])
+            self.assertEqual(page["first"], ["<li>A</li>"])
+
+    def test_store_is_keyed_on_class_and_profile_vars(self):
+        store = recrawl.RecrawlStore()
+        self.assertEqual(
+            store.key(TitlePage(slug="manoha")), store.key(TitlePage(slug="manoha"))
+        )
+        self.assertNotEqual(
+            store.key(TitlePage(slug="manoha")), store.key(TitlePage(slug="dahokan"))
+        )
+        self.assertNotEqual(
+            store.key(TitlePage(url="manoha")), store.key(base.Hypertext(url="manoha"))
+        )
+
 
 base.register(base.Hypertext)
 